@@ -10,7 +10,7 @@ SPDX-License-Identifier: BSD-2-Clause
 """
 
 from __future__ import print_function
-from typing import Any
+from typing import Any, Optional
 import logging
 import sys
 import platform
@@ -21,6 +21,8 @@ import json
 import hashlib
 import ssl
 import subprocess
+import shutil
+import tempfile
 from zipfile import ZipFile, is_zipfile
 import urllib.request
 from urllib.error import HTTPError, URLError
@@ -28,7 +30,7 @@ from urllib.parse import urlparse, quote, unquote, urljoin
 import socket
 import time
 
-__MY_VERSION__ = '0.0.2'
+__MY_VERSION__ = '0.0.3'
 
 MY_BASEPATH: str = os.path.dirname(sys.argv[0])
 MY_DIRPATH: str = os.path.abspath(MY_BASEPATH)
@@ -55,10 +57,31 @@ def main():
     arg_data: dict[str, Any] = parse_args()
     LOGGER.debug('Starting up...')
 
+    l_profiles: list[dict[str, Any]] = load_profiles(arg_data)
+    if not l_profiles:
+        LOGGER.error("There are no build profiles")
+        sys.exit(2)
+
+    d_loaded: dict[str, dict[str, Any]] = {}
+    d_cores_db: dict[str, Any] = {}
+    for d_profile in l_profiles:
+        s_cores_db: str = d_profile['cores_db']
+        if s_cores_db not in d_loaded:
+            d_loaded[s_cores_db] = load_cores_bd(s_cores_db)
+        d_tmp: dict[str, Any] = d_loaded[s_cores_db]
+        if not d_tmp:
+            LOGGER.error("There's no Cores DB JSON file")
+            sys.exit(2)
+
+        d_profile['cores'] = filter_cores(d_tmp, d_profile['include'],
+                                          d_profile['exclude'])
+        for s_key, o_values in d_profile['cores'].items():
+            if s_key not in d_cores_db:
+                d_cores_db[s_key] = o_values
+
     s_cache_path: str = arg_data['cache_dir']
     s_roms_path: str = os.path.join(s_cache_path, 'roms')
     s_mras_path: str = os.path.join(s_cache_path, 'mra')
-    s_out_path: str = arg_data['output_dir']
 
     d_arcade_db: dict[str, Any] = load_arcade_bd(s_cache_path,
                                                  arg_data['force_bda'],
@@ -73,13 +96,6 @@ def main():
         LOGGER.error("There's no MRA JSON data")
         sys.exit(2)
 
-    d_tmp: dict[str, Any] = load_cores_bd(arg_data['cores_db'])
-    if not d_tmp:
-        LOGGER.error("There's no Cores DB JSON file")
-        sys.exit(2)
-
-    d_cores_db = filter_cores(d_tmp, arg_data['include'], arg_data['exclude'])
-
     print('Checking ROM ZIP files cache...')
     chk_zip_cache(d_arcade_db, d_cores_db, s_roms_path, arg_data['force'])
 
@@ -90,8 +106,8 @@ def main():
 
     if arg_data['build_arc_rom']:
         print('Building ARC files...')
-        build_arc_files(d_mras, d_cores_db, s_out_path, s_mras_path,
-                        s_roms_path, s_cache_path)
+        build_arc_files(d_mras, l_profiles, s_mras_path, s_roms_path,
+                        s_cache_path)
 
 
 def parse_args() -> dict[str, Any]:
@@ -105,6 +121,7 @@ def parse_args() -> dict[str, Any]:
     values['cache_dir'] = os.path.join(MY_DIRPATH, 'cache')
     values['cores_db'] = os.path.join(MY_DIRPATH, 'cores.json')
     values['output_dir'] = os.path.join(MY_DIRPATH, 'JOTEGO')
+    values['batch'] = ''
     values['force_bda'] = False
     values['force_bdm'] = False
     values['include'] = []
@@ -141,6 +158,12 @@ def parse_args() -> dict[str, Any]:
                         action='store',
                         dest='output_dir',
                         help='Output dir name and location')
+    parser.add_argument('-b',
+                        '--batch',
+                        required=False,
+                        action='store',
+                        dest='batch',
+                        help='Batch JSON file with build profiles')
     parser.add_argument('-a',
                         '--force_arcade_db',
                         required=False,
@@ -214,6 +237,9 @@ def parse_args() -> dict[str, Any]:
     if arguments.output_dir:
         values['output_dir'] = os.path.abspath(arguments.output_dir)
 
+    if arguments.batch:
+        values['batch'] = os.path.abspath(arguments.batch)
+
     if arguments.force_bda:
         values['force_bda'] = arguments.force_bda
 
@@ -257,15 +283,109 @@ def load_cores_bd(s_name: str) -> dict[str, Any]:
     d_cores: dict[str, Any] = {}
     if not os.path.isfile(s_name):
         LOGGER.error('Cores database not found: %s', s_name)
+        return d_cores
 
     with open(s_name, 'r', encoding='utf-8') as json_handle:
         LOGGER.debug('Loading Cores database...')
-        d_cores = json.load(json_handle)
+        try:
+            d_cores = json.load(json_handle)
+        except json.JSONDecodeError as error:
+            LOGGER.error('Cores database is not valid JSON: %s! %s', s_name,
+                         error)
+            return {}
         LOGGER.debug('%s loaded OK', s_name)
 
     return d_cores
 
 
+def load_profiles(arg_data: dict[str, Any]) -> list[dict[str, Any]]:
+    """
+    Gets the list of build profiles, from a batch JSON file or the arguments
+    :param arg_data: Dictionary with command line options
+    :return: List of dictionaries with cores DB, include, exclude and output
+    """
+
+    d_default: dict[str, Any] = {
+        'cores_db': arg_data['cores_db'],
+        'include': arg_data['include'],
+        'exclude': arg_data['exclude'],
+        'output_dir': arg_data['output_dir']
+    }
+
+    s_name: str = arg_data['batch']
+    if not s_name:
+        return [d_default]
+
+    l_profiles: list[dict[str, Any]] = []
+    if not os.path.isfile(s_name):
+        LOGGER.error('Batch file not found: %s', s_name)
+        return l_profiles
+
+    with open(s_name, 'r', encoding='utf-8') as json_handle:
+        LOGGER.debug('Loading batch profiles...')
+        try:
+            o_batch: Any = json.load(json_handle)
+        except json.JSONDecodeError as error:
+            LOGGER.error('Batch file is not valid JSON: %s! %s', s_name, error)
+            return l_profiles
+        LOGGER.debug('%s loaded OK', s_name)
+
+    if not isinstance(o_batch, list):
+        LOGGER.error('Batch file must contain a list of profiles: %s', s_name)
+        return l_profiles
+
+    s_batch_dir: str = os.path.dirname(s_name)
+    for i_index, d_batch in enumerate(o_batch):
+        if not isinstance(d_batch, dict):
+            LOGGER.error('Batch profile %s is not a JSON object', i_index)
+            return []
+
+        for s_key in d_batch:
+            if not s_key in d_default:
+                LOGGER.warning('Batch profile %s: unknown key %s', i_index,
+                               s_key)
+
+        d_profile: dict[str, Any] = dict(d_default)
+        for s_key in ['cores_db', 'output_dir']:
+            if d_batch.get(s_key):
+                if not isinstance(d_batch[s_key], str):
+                    LOGGER.error('Batch profile %s: %s must be a string',
+                                 i_index, s_key)
+                    return []
+                d_profile[s_key] = os.path.normpath(
+                    os.path.join(s_batch_dir, d_batch[s_key]))
+        for s_key in ['include', 'exclude']:
+            if s_key in d_batch:
+                o_value: Any = d_batch[s_key]
+                if isinstance(o_value, str):
+                    o_value = [o_value]
+                if not isinstance(o_value, list) or not all(
+                        isinstance(o_item, str) for o_item in o_value):
+                    LOGGER.error(
+                        'Batch profile %s: %s must be a string or a list'
+                        ' of strings', i_index, s_key)
+                    return []
+                d_profile[s_key] = []
+                for s_value in o_value:
+                    if s_value:
+                        d_profile[s_key] += s_value.split(',')
+
+        b_duplicate: bool = False
+        for d_other in l_profiles:
+            if d_other['output_dir'] == d_profile['output_dir']:
+                if d_other != d_profile:
+                    LOGGER.error('Batch profiles with different cores share'
+                                 ' the output dir %s', d_profile['output_dir'])
+                    return []
+                LOGGER.warning('Batch profile %s is repeated, skipping',
+                               i_index)
+                b_duplicate = True
+        if not b_duplicate:
+            l_profiles.append(d_profile)
+
+    return l_profiles
+
+
 def load_arcade_bd(s_dirpath: str,
                    b_force: bool,
                    s_commit: str = '') -> dict[str, Any]:
@@ -335,6 +455,22 @@ def filter_cores(d_cores_db: dict[str, Any], l_include: list[str],
     return d_result
 
 
+def index_tags(d_db: dict[str, Any]) -> dict[Any, list[str]]:
+    """
+    Indexes the tag dictionary of a DB by tag value
+    :param d_db: Dict with arcade or MRA DB
+    :return: Dict with the list of tag names for each tag value
+    """
+
+    d_tagnames: dict[Any, list[str]] = {}
+    for s_tagname, o_tag in d_db['tag_dictionary'].items():
+        if not o_tag in d_tagnames:
+            d_tagnames[o_tag] = []
+        d_tagnames[o_tag].append(s_tagname)
+
+    return d_tagnames
+
+
 def chk_zip_cache(d_arcade_db: dict[str, Any], d_cores_db: dict[str, Any],
                   s_roms_path: str, b_force: bool):
     """
@@ -347,19 +483,21 @@ def chk_zip_cache(d_arcade_db: dict[str, Any], d_cores_db: dict[str, Any],
     """
 
     d_files: dict[str, Any] = d_arcade_db['files']
-    d_tags: dict[str, Any] = d_arcade_db['tag_dictionary']
+    d_tagnames: dict[Any, list[str]] = index_tags(d_arcade_db)
 
-    for s_file in d_files:
+    for s_file, d_file in d_files.items():
         s_name: str = s_file.split('/')[-1]
-        for i_item in d_files[s_file]['tags']:
-            for j_item in d_tags:
-                if d_tags[j_item] == i_item and j_item in d_cores_db:
-                    b_ok = chk_or_download(s_roms_path, s_name,
-                                           d_files[s_file]['hash'],
-                                           d_files[s_file]['size'],
-                                           d_files[s_file]['url'], b_force)
-                    if not b_ok:
-                        print(f'{s_name} Bad file!')
+        b_needed: bool = False
+        for i_item in d_file['tags']:
+            for s_tagname in d_tagnames.get(i_item, []):
+                if s_tagname in d_cores_db:
+                    b_needed = True
+
+        if b_needed:
+            b_ok = chk_or_download(s_roms_path, s_name, d_file['hash'],
+                                   d_file['size'], d_file['url'], b_force)
+            if not b_ok:
+                print(f'{s_name} Bad file!')
 
 
 def chk_mra_cache(d_mra_db: dict[str, Any],
@@ -383,86 +521,161 @@ def chk_mra_cache(d_mra_db: dict[str, Any],
         s_commit = 'master'
 
     d_files: dict[str, Any] = d_mra_db['files']
-    d_tags: dict[str, Any] = d_mra_db['tag_dictionary']
+    d_tagnames: dict[Any, list[str]] = index_tags(d_mra_db)
     s_baseurl: str = f'https://raw.githubusercontent.com/jotego/jtbin/{s_commit}/mra/'
-    for s_file in d_files:
+    for s_file, d_file in d_files.items():
         s_name: str = s_file.split('/')[-1]
         if s_name.endswith('.mra') and not '_alternatives' in s_file:
-            for s_item in d_files[s_file]['tags']:
-                for s_tagitem in d_tags:
-                    if d_tags[s_tagitem] == s_item and ''.join(
-                            s_tagitem.split('arcade')) in d_cores_db:
+            b_needed: bool = False
+            for s_item in d_file['tags']:
+                for s_tagitem in d_tagnames.get(s_item, []):
+                    if ''.join(s_tagitem.split('arcade')) in d_cores_db:
                         if not s_tagitem in d_mras:
                             d_mras[s_tagitem] = []
                         d_mras[s_tagitem].append(s_name)
-                        b_ok = chk_or_download(s_mras_path, s_name,
-                                               d_files[s_file]['hash'],
-                                               d_files[s_file]['size'],
-                                               s_baseurl + s_name, b_force)
-                        if not b_ok:
-                            print(f'{s_name} Bad file!')
+                        b_needed = True
+
+            if b_needed:
+                b_ok = chk_or_download(s_mras_path, s_name, d_file['hash'],
+                                       d_file['size'], s_baseurl + s_name,
+                                       b_force)
+                if not b_ok:
+                    print(f'{s_name} Bad file!')
 
     return d_mras
 
 
-def build_arc_files(d_mras: dict[str, Any], d_cores_db: dict[str, Any],
-                    s_out_path: str, s_mras_path: str, s_roms_path,
-                    s_cache_path: str):
+def get_arc_jobs(d_mras: dict[str, Any],
+                 d_cores_db: dict[str, Any]) -> list[tuple[str, str, str]]:
+    """
+    Lists the ARC and ROM files to build from MRA files
+    :param d_mras: Dict with MRA groups info
+    :param d_cores_db: Dict with cores DB
+    :return: List of (MRA file, ARC name or empty, output subdir or empty)
+    """
+
+    l_jobs: list[tuple[str, str, str]] = []
+    for s_mra, l_mra in d_mras.items():
+        s_basename_arc: str = ''.join(s_mra.split('arcade'))
+        if not s_basename_arc in d_cores_db:
+            continue
+
+        s_subdir_arc: str = ''
+        if len(l_mra) > 1:
+            s_subdir_arc: str = ''.join(s_basename_arc.split('jt')).upper()
+
+        for s_submra in l_mra:
+            default_mra = d_cores_db[s_basename_arc]['default_mra']
+            if s_subdir_arc == '' or (default_mra != '' and
+                                      s_submra.startswith(default_mra)):
+                s_arc_name: str = s_basename_arc + '.arc'
+                if d_cores_db[s_basename_arc]['default_arc'] != '':
+                    s_arc_name = d_cores_db[s_basename_arc][
+                        'default_arc'] + '.arc'
+                l_jobs.append((s_submra, s_arc_name.upper(), ''))
+
+            l_jobs.append((s_submra, '', s_subdir_arc))
+
+    return l_jobs
+
+
+def build_arc_files(d_mras: dict[str, Any], l_profiles: list[dict[str, Any]],
+                    s_mras_path: str, s_roms_path, s_cache_path: str):
     """
-    Builds ARC and ROM files from MRA and ROM ZIP files
+    Builds ARC and ROM files from MRA and ROM ZIP files, for all profiles,
+    building only once the files that are the same for several of them
     :param d_mras: Dict with MRA groups info
-    :param s_out_path: Base path where the ARC and ROM files are created
+    :param l_profiles: List of profiles, with filtered cores and output dir
     :param s_mras_path: Path for the MRA files cache
     :param s_roms_path: Path for the ROM ZIP files cache
     :param s_cache_path: Path to the main cache (to find the bin)
     :return: Nothing
     """
 
-    if not os.path.isdir(s_out_path):
-        pathlib.Path(s_out_path).mkdir(parents=True, exist_ok=True)
+    for d_profile in l_profiles:
+        if not os.path.isdir(d_profile['output_dir']):
+            pathlib.Path(d_profile['output_dir']).mkdir(parents=True,
+                                                        exist_ok=True)
 
     s_mra_bindirpath: str = os.path.join(s_cache_path, 'bin')
     s_mra_binpath: str = chk_or_download_mrabin(s_mra_bindirpath)
-    if s_mra_binpath != '':
-        for s_mra, l_mra in d_mras.items():
-            s_basename_arc: str = ''.join(s_mra.split('arcade'))
-            s_subdir_arc: str = ''
-            if len(l_mra) > 1:
-                s_subdir_arc: str = ''.join(s_basename_arc.split('jt')).upper()
-
-            for s_submra in l_mra:
-                s_mra_path: str = os.path.join(s_mras_path, s_submra)
-                default_mra = d_cores_db[s_basename_arc]['default_mra']
-                l_mra_params: list[str] = []
-
-                s_arc_path: str = s_out_path
-                if s_subdir_arc == '' or (default_mra != '' and
-                                          s_submra.startswith(default_mra)):
-                    s_arc_name: str = ''.join(s_mra.split('arcade')) + '.arc'
-                    if d_cores_db[s_basename_arc]['default_arc'] != '':
-                        s_arc_name = d_cores_db[s_basename_arc][
-                            'default_arc'] + '.arc'
-
-                    l_mra_params = [
-                        s_mra_binpath, '-A', '-z', s_roms_path, '-O',
-                        s_arc_path, '-a',
-                        s_arc_name.upper(), s_mra_path
-                    ]
-                    LOGGER.debug(' '.join(l_mra_params))
-                    run_process(l_mra_params, s_submra)
-
-                if s_subdir_arc != '':
-                    s_arc_path = os.path.join(s_arc_path, s_subdir_arc)
-                    if not os.path.isdir(s_arc_path):
-                        pathlib.Path(s_arc_path).mkdir(parents=True,
-                                                       exist_ok=True)
-
-                l_mra_params = [
-                    s_mra_binpath, '-A', '-z', s_roms_path, '-O', s_arc_path,
-                    s_mra_path
-                ]
-                LOGGER.debug(' '.join(l_mra_params))
-                run_process(l_mra_params, s_submra)
+    if s_mra_binpath == '':
+        return
+
+    # Each profile goes through its jobs in the same order as a standalone
+    # run, so when several jobs write the same file, the last one wins as it
+    # would on its own. A job already built elsewhere is copied instead of
+    # built again, but only while its files there have not been overwritten
+    # by another job; otherwise it is forgotten and built again when needed.
+    d_built: dict[tuple[str, str], tuple[str, list[str]]] = {}
+    d_writers: dict[str, tuple[str, str]] = {}
+    for d_profile in l_profiles:
+        for s_submra, s_arc_name, s_subdir_arc in get_arc_jobs(
+                d_mras, d_profile['cores']):
+            s_arc_path: str = d_profile['output_dir']
+            if s_subdir_arc != '':
+                s_arc_path = os.path.join(s_arc_path, s_subdir_arc)
+                if not os.path.isdir(s_arc_path):
+                    pathlib.Path(s_arc_path).mkdir(parents=True,
+                                                   exist_ok=True)
+
+            t_job: tuple[str, str] = (s_submra, s_arc_name)
+            l_files: list[str] = []
+            if t_job in d_built:
+                s_src_path, l_files = d_built[t_job]
+                if s_src_path != s_arc_path:
+                    LOGGER.debug('Copying %s from %s', s_submra, s_src_path)
+                    for s_file in l_files:
+                        shutil.copy2(os.path.join(s_src_path, s_file),
+                                     s_arc_path)
+            else:
+                l_files = run_mra(s_mra_binpath, s_roms_path, s_arc_path,
+                                  s_arc_name,
+                                  os.path.join(s_mras_path, s_submra))
+                d_built[t_job] = (s_arc_path, l_files)
+
+            for s_file in l_files:
+                s_fpath: str = os.path.join(s_arc_path, s_file)
+                t_writer: Optional[tuple[str, str]] = d_writers.get(s_fpath)
+                if t_writer and t_writer != t_job and t_writer in d_built:
+                    if d_built[t_writer][0] == s_arc_path:
+                        del d_built[t_writer]
+                d_writers[s_fpath] = t_job
+
+
+def run_mra(s_mra_binpath: str, s_roms_path: str, s_arc_path: str,
+            s_arc_name: str, s_mra_path: str) -> list[str]:
+    """
+    Runs mra tool to build ARC and ROM files from a MRA file
+    :param s_mra_binpath: Path to the mra binary file
+    :param s_roms_path: Path for the ROM ZIP files cache
+    :param s_arc_path: Path where the ARC and ROM files are created
+    :param s_arc_name: If not empty, name for the ARC file
+    :param s_mra_path: Path to the MRA file
+    :return: List with the names of the files created
+    """
+
+    # Build in an empty scratch dir inside the destination, so the files
+    # created are known exactly and can be moved (not copied) into place
+    s_tmp_path: str = tempfile.mkdtemp(prefix='.build_', dir=s_arc_path)
+    l_mra_params: list[str] = [
+        s_mra_binpath, '-A', '-z', s_roms_path, '-O', s_tmp_path
+    ]
+    if s_arc_name != '':
+        l_mra_params += ['-a', s_arc_name]
+    l_mra_params.append(s_mra_path)
+    LOGGER.debug(' '.join(l_mra_params))
+    run_process(l_mra_params, os.path.basename(s_mra_path))
+
+    l_files: list[str] = []
+    for s_file in os.listdir(s_tmp_path):
+        s_tmp_fpath: str = os.path.join(s_tmp_path, s_file)
+        if os.path.isfile(s_tmp_fpath):
+            os.replace(s_tmp_fpath, os.path.join(s_arc_path, s_file))
+            l_files.append(s_file)
+    shutil.rmtree(s_tmp_path)
+
+    return l_files
 
 
 def load_zip_bd(s_dirpath: str, s_name: str, s_urlbase: str,